@@ -1,9 +1,21 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import aiohttp
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+from selectolax.lexbor import LexborHTMLParser
+import codecs
 import csv
-import json
+import math
+import os
 import time
-from requests.exceptions import RequestException, Timeout, ReadTimeout
+from functools import lru_cache
+
+try:
+    import brotli  # noqa: F401 - lets aiohttp decode "br" responses
+    ACCEPT_ENCODING = "br, gzip"
+except ImportError:
+    ACCEPT_ENCODING = "gzip"
 
 SEARCH_URL = "https://www.pakwheels.com/used-cars/search/-/"
 HEADERS = {
@@ -13,13 +25,61 @@ HEADERS = {
         "Chrome/120.0.0.0 Safari/537.36"
     ),
     "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": ACCEPT_ENCODING,
 }
 
 MAX_RETRIES = 5
 BASE_DELAY = 2
 SAVE_INTERVAL = 20
+OUTPUT_FILE = "pakwheels_cars_final.csv"
+PARQUET_FILE = "pakwheels_cars_final.parquet"
+PROGRESS_FILE = "pakwheels_cars_final.progress"
+PARTIAL_OUTPUT_FILE = f"{OUTPUT_FILE}.partial"
+PARTIAL_PARQUET_FILE = f"{PARQUET_FILE}.partial"
+CONCURRENCY = 8
+BATCH_SIZE = 16
+KEEPALIVE_TIMEOUT = 60
+INITIAL_DELAY = 0.25
+MIN_DELAY = 0.2
+MAX_DELAY = 10
+MAX_RETRY_AFTER = 60
+THROTTLE_STATUSES = (429, 503)
+EXPECTED_PAGE_SIZE = 20
+MAX_CONSECUTIVE_EMPTY = 3
+MAX_CONSECUTIVE_SHORT = 2
+
+FIELDNAMES = [
+    "title",
+    "price",
+    "year",
+    "mileage",
+    "fuel_type",
+    "engine_capacity",
+    "transmission",
+    "link",
+]
+PARQUET_SCHEMA = pa.schema([
+    ("title", pa.string()),
+    ("price", pa.int64()),
+    ("year", pa.int16()),
+    ("mileage", pa.int32()),
+    ("fuel_type", pa.string()),
+    ("engine_capacity", pa.int32()),
+    ("transmission", pa.string()),
+    ("link", pa.string()),
+])
+
+LISTING_SELECTOR = "ul.search-results li.classified-listing"
+JSONLD_SELECTOR = 'script[type="application/ld+json"]'
+SPEC_ICON_SELECTOR = 'ul.ad-specs li i[class*="pw-"]'
+LISTING_NODES_SELECTOR = f"{JSONLD_SELECTOR}, {SPEC_ICON_SELECTOR}"
+SPEC_KINDS = {
+    "pw-mileage": "mileage",
+    "pw-engine": "engine",
+}
 
 
+@lru_cache(maxsize=4096)
 def parse_engine_specs(engine_text: str):
     parts = [p.strip() for p in engine_text.split(' . ')]
     fuel_type = ""
@@ -34,173 +94,273 @@ def parse_engine_specs(engine_text: str):
     return fuel_type, engine_capacity, transmission
 
 
-def scrape_page(session: requests.Session, page: int):
-    for attempt in range(MAX_RETRIES):
+def parse_number(text: str, unit: str = "", bits: int = 64):
+    digits = text.replace(unit, "").replace(",", "").strip()
+    try:
+        value = int(float(digits))
+    except (ValueError, OverflowError):
+        return None
+    limit = 2 ** (bits - 1)
+    return value if -limit <= value < limit else None
+
+
+def parse_column(cars, name, unit=""):
+    bits = PARQUET_SCHEMA.field(name).type.bit_width
+    return [parse_number(v, unit, bits) for v in cars[name]]
+
+
+def to_parquet_table(cars):
+    return pa.table({
+        **cars,
+        "price": parse_column(cars, "price", "PKR"),
+        "year": parse_column(cars, "year"),
+        "mileage": parse_column(cars, "mileage", "km"),
+        "engine_capacity": parse_column(cars, "engine_capacity", "cc"),
+    }, schema=PARQUET_SCHEMA)
+
+
+class PoliteDelay:
+    def __init__(self):
+        self.current = INITIAL_DELAY
+        self.next_allowed = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        start = max(now, self.next_allowed)
+        self.next_allowed = start + self.current
+        await asyncio.sleep(start - now)
+
+    def on_success(self):
+        self.current = max(self.current * 0.9, MIN_DELAY)
+
+    def on_throttle(self, retry_after=None):
+        self.current = min(self.current * 2, MAX_DELAY)
         try:
-            print(f"Scraping page {page}... (attempt {attempt + 1}/{MAX_RETRIES})")
-            params = {"page": page}
-            timeout = 20 + (attempt * 10)
-            resp = session.get(SEARCH_URL, headers=HEADERS, params=params, timeout=timeout)
-            resp.raise_for_status()
-            soup = BeautifulSoup(resp.text, "lxml")
-            cars = []
-            for li in soup.select("ul.search-results li.classified-listing"):
-                script_tag = li.find("script", attrs={"type": "application/ld+json"})
-                if not script_tag or not script_tag.string:
-                    continue
-                try:
-                    data = json.loads(script_tag.string)
-                except Exception:
-                    continue
-                title = data.get("name", "").strip()
-                year = data.get("modelDate", "")
-                offers = data.get("offers", {}) or {}
-                price = offers.get("price", "")
-                currency = offers.get("priceCurrency", "PKR")
-                link = offers.get("url", "")
-                if isinstance(year, (int, float)):
-                    year = str(year)
-                if isinstance(price, (int, float)):
-                    price_str = f"{currency} {price:,}"
+            retry_after = float(retry_after or 0)
+        except ValueError:
+            return
+        if math.isfinite(retry_after) and retry_after > 0:
+            retry_at = time.monotonic() + min(retry_after, MAX_RETRY_AFTER)
+            self.next_allowed = max(self.next_allowed, retry_at)
+
+
+def decode_html(body: bytes, charset):
+    # Lexbor parses bytes as UTF-8 and ignores <meta charset>; pakwheels serves
+    # UTF-8, so only decode here when the response declares something else.
+    try:
+        if charset and codecs.lookup(charset).name != "utf-8":
+            return body.decode(charset, errors="replace")
+    except LookupError:
+        pass
+    return body
+
+
+def empty_columns():
+    return {name: [] for name in FIELDNAMES}
+
+
+async def scrape_page(
+    session: aiohttp.ClientSession, page: int, sem: asyncio.Semaphore, delay: PoliteDelay
+):
+    async with sem:
+        for attempt in range(MAX_RETRIES):
+            try:
+                await delay.wait()
+                print(f"Scraping page {page}... (attempt {attempt + 1}/{MAX_RETRIES})")
+                params = {"page": page}
+                timeout = aiohttp.ClientTimeout(total=20 + (attempt * 10))
+                async with session.get(SEARCH_URL, params=params, timeout=timeout) as resp:
+                    if resp.status in THROTTLE_STATUSES:
+                        delay.on_throttle(resp.headers.get("Retry-After"))
+                        print(f"  🐢 Throttled on page {page}, delay now {delay.current:.2f}s")
+                    resp.raise_for_status()
+                    html = decode_html(await resp.read(), resp.charset)
+                delay.on_success()
+                tree = LexborHTMLParser(html)
+                cars = empty_columns()
+                for li in tree.css(LISTING_SELECTOR):
+                    script_text = ""
+                    spec_icons = []
+                    for node in li.css(LISTING_NODES_SELECTOR):
+                        if node.tag == "script":
+                            script_text = script_text or node.text()
+                        else:
+                            spec_icons.append(node)
+                    if not script_text:
+                        continue
+                    try:
+                        data = orjson.loads(script_text)
+                    except orjson.JSONDecodeError:
+                        continue
+                    title = data.get("name", "").strip()
+                    year = str(data.get("modelDate") or "")
+                    offers = data.get("offers", {}) or {}
+                    price = offers.get("price", "")
+                    currency = offers.get("priceCurrency") or "PKR"
+                    link = offers.get("url", "")
+                    try:
+                        price_str = f"{currency} {price:,}"
+                    except (TypeError, ValueError):
+                        price_str = str(price)
+                    mileage = ""
+                    fuel_type = ""
+                    transmission = ""
+                    engine_capacity = ""
+                    for icon in spec_icons:
+                        classes = (icon.attributes.get("class") or "").split()
+                        kind = SPEC_KINDS.get(next((c for c in classes if c.startswith("pw-")), None))
+                        if kind == "mileage":
+                            mileage = icon.parent.text(strip=True)
+                        elif kind == "engine":
+                            fuel_type, engine_capacity, transmission = parse_engine_specs(
+                                icon.parent.text(strip=True)
+                            )
+                    cars["title"].append(title)
+                    cars["price"].append(price_str)
+                    cars["year"].append(year)
+                    cars["mileage"].append(mileage)
+                    cars["fuel_type"].append(fuel_type)
+                    cars["engine_capacity"].append(engine_capacity)
+                    cars["transmission"].append(transmission)
+                    cars["link"].append(link)
+                print(f"  -> found {len(cars['link'])} cars on this page")
+                return cars
+            except asyncio.TimeoutError:
+                wait_time = BASE_DELAY * (2 ** attempt)
+                print(f"  ⚠️  Timeout on page {page} (attempt {attempt + 1}/{MAX_RETRIES})")
+                if attempt < MAX_RETRIES - 1:
+                    print(f"  ⏳ Waiting {wait_time} seconds before retry...")
+                    await asyncio.sleep(wait_time)
                 else:
-                    price_str = str(price)
-                mileage = ""
-                fuel_type = ""
-                transmission = ""
-                engine_capacity = ""
-                specs_ul = li.select_one("ul.ad-specs")
-                if specs_ul:
-                    for spec_li in specs_ul.find_all("li"):
-                        icon = spec_li.find("i")
-                        classes = icon.get("class", []) if icon else []
-                        text = spec_li.get_text(strip=True)
-                        if any("pw-mileage" in c for c in classes):
-                            mileage = text
-                        elif any("pw-engine" in c for c in classes):
-                            fuel_type, engine_capacity, transmission = parse_engine_specs(text)
-                cars.append({
-                    "title": title,
-                    "price": price_str,
-                    "year": year,
-                    "mileage": mileage,
-                    "fuel_type": fuel_type,
-                    "engine_capacity": engine_capacity,
-                    "transmission": transmission,
-                    "link": link,
-                })
-            print(f"  -> found {len(cars)} cars on this page")
-            return cars
-        except (ReadTimeout, Timeout):
-            wait_time = BASE_DELAY * (2 ** attempt)
-            print(f"  ⚠️  Timeout on page {page} (attempt {attempt + 1}/{MAX_RETRIES})")
-            if attempt < MAX_RETRIES - 1:
-                print(f"  ⏳ Waiting {wait_time} seconds before retry...")
-                time.sleep(wait_time)
-            else:
-                print(f"  ❌ Failed to scrape page {page} after {MAX_RETRIES} attempts")
-                return []
-        except RequestException as e:
-            print(f"  ⚠️  Request error on page {page}: {type(e).__name__}")
-            wait_time = BASE_DELAY * (2 ** attempt)
-            if attempt < MAX_RETRIES - 1:
-                print(f"  ⏳ Waiting {wait_time} seconds before retry...")
-                time.sleep(wait_time)
-            else:
-                print(f"  ❌ Failed to scrape page {page} after {MAX_RETRIES} attempts")
-                return []
-        except Exception as e:
-            print(f"  ❌ Unexpected error on page {page}: {type(e).__name__}: {e}")
-            return []
-    return []
-
-
-def save_to_csv(cars, filename):
-    fieldnames = [
-        "title",
-        "price",
-        "year",
-        "mileage",
-        "fuel_type",
-        "engine_capacity",
-        "transmission",
-        "link",
-    ]
-    with open(filename, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(cars)
-    print(f"💾 Saved to {filename}")
-
-
-def main():
-    all_cars = []
-    session = requests.Session()
-
-    from requests.adapters import HTTPAdapter
-    from urllib3.util.retry import Retry
-
-    retry_strategy = Retry(
-        total=3,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
+                    print(f"  ❌ Failed to scrape page {page} after {MAX_RETRIES} attempts")
+                    return None
+            except aiohttp.ClientError as e:
+                print(f"  ⚠️  Request error on page {page}: {type(e).__name__}")
+                wait_time = BASE_DELAY * (2 ** attempt)
+                if attempt < MAX_RETRIES - 1:
+                    print(f"  ⏳ Waiting {wait_time} seconds before retry...")
+                    await asyncio.sleep(wait_time)
+                else:
+                    print(f"  ❌ Failed to scrape page {page} after {MAX_RETRIES} attempts")
+                    return None
+            except Exception as e:
+                print(f"  ❌ Unexpected error on page {page}: {type(e).__name__}: {e}")
+                return None
+        return None
+
+
+def write_progress(page):
+    with open(PROGRESS_FILE, "w", encoding="utf-8") as progress:
+        progress.write(f"{page}\n")
+
+
+def save_checkpoint(f, page):
+    f.flush()
+    os.fsync(f.fileno())
+    write_progress(page)
+    print(f"💾 Synced {f.name} through page {page}")
+
+
+async def main():
+    total_cars = 0
+    all_cars = empty_columns()
+    failed_pages = []
+    sem = asyncio.Semaphore(CONCURRENCY)
+    delay = PoliteDelay()
+    connector = aiohttp.TCPConnector(
+        limit=CONCURRENCY,
+        limit_per_host=CONCURRENCY,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=300,
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
 
     start = time.perf_counter()
 
     page = 1
     consecutive_empty = 0
+    consecutive_short = 0
     MAX_PAGES = 2000
 
     print("🚀 Starting PakWheels scraper...")
-    print(f"   Settings: Max retries={MAX_RETRIES}, Save interval={SAVE_INTERVAL} pages\n")
+    print(f"   Settings: Max retries={MAX_RETRIES}, Save interval={SAVE_INTERVAL} pages")
+    print(f"   Concurrency: {CONCURRENCY} requests, batches of {BATCH_SIZE} pages\n")
     print(f"   Target pages: {MAX_PAGES}\n")
 
-    try:
-        while page <= MAX_PAGES:
-            cars = scrape_page(session, page)
-
-            if not cars:
-                print(f"⚠️  No cars found on page {page}")
-                consecutive_empty += 1
-                page += 1
-                time.sleep(2)
-                continue
-
-            consecutive_empty = 0
-            all_cars.extend(cars)
-            print(f"📊 Total collected so far: {len(all_cars)}")
-
-            if page % SAVE_INTERVAL == 0:
-                backup_file = f"pakwheels_cars_backup_page{page}.csv"
-                save_to_csv(all_cars, backup_file)
-                print(f"✅ Checkpoint saved at page {page}\n")
-
-            page += 1
-            time.sleep(1.5)
-
-    except KeyboardInterrupt:
-        print("\n\n⚠️  Scraping interrupted by user!")
-    except Exception as e:
-        print(f"\n\n❌ Unexpected error: {type(e).__name__}: {e}")
-    finally:
-        print(f"\n{'='*60}")
-        print(f"📈 Final Statistics:")
-        print(f"   Total cars collected: {len(all_cars)}")
-        print(f"   Pages scraped: {page - 1}")
-        end = time.perf_counter()
-        elapsed = end - start
-        print(f"   Total time: {elapsed:.2f} seconds ({elapsed / 60:.2f} minutes)")
-        print(f"{'='*60}\n")
-
-        if all_cars:
-            save_to_csv(all_cars, "pakwheels_cars_final.csv")
-            print("\n✅ Scraping complete!")
-        else:
-            print("\n⚠️  No data collected")
+    with open(PARTIAL_OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDNAMES)
+
+        try:
+            async with aiohttp.ClientSession(headers=HEADERS, connector=connector) as session:
+                while page <= MAX_PAGES:
+                    batch = range(page, min(page + BATCH_SIZE, MAX_PAGES + 1))
+                    results = await asyncio.gather(*(scrape_page(session, p, sem, delay) for p in batch))
+
+                    for batch_page, cars in zip(batch, results):
+                        if cars is None:
+                            failed_pages.append(batch_page)
+                            continue
+
+                        count = len(cars["link"])
+                        if not count:
+                            print(f"⚠️  No cars found on page {batch_page}")
+                            consecutive_empty += 1
+                            continue
+
+                        consecutive_empty = 0
+                        writer.writerows(zip(*(cars[name] for name in FIELDNAMES)))
+                        for name in FIELDNAMES:
+                            all_cars[name].extend(cars[name])
+                        f.flush()
+                        total_cars += count
+                        print(f"📊 Total collected so far: {total_cars}")
+
+                        if batch_page % SAVE_INTERVAL == 0:
+                            save_checkpoint(f, batch_page)
+                            print(f"✅ Checkpoint saved at page {batch_page}\n")
+
+                        if count < EXPECTED_PAGE_SIZE // 2:
+                            consecutive_short += 1
+                        else:
+                            consecutive_short = 0
+
+                    page = batch.stop
+
+                    if consecutive_empty >= MAX_CONSECUTIVE_EMPTY:
+                        print(f"🛑 No data for {MAX_CONSECUTIVE_EMPTY} consecutive pages — stopping.")
+                        break
+                    if consecutive_short >= MAX_CONSECUTIVE_SHORT:
+                        print(f"🛑 {MAX_CONSECUTIVE_SHORT} short pages in a row — reached the last page.")
+                        break
+
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            print("\n\n⚠️  Scraping interrupted by user!")
+        except Exception as e:
+            print(f"\n\n❌ Unexpected error: {type(e).__name__}: {e}")
+        finally:
+            f.flush()
+            os.fsync(f.fileno())
+            print(f"\n{'='*60}")
+            print(f"📈 Final Statistics:")
+            print(f"   Total cars collected: {total_cars}")
+            print(f"   Pages scraped: {page - 1}")
+            if failed_pages:
+                print(f"   Failed pages ({len(failed_pages)}): {', '.join(map(str, failed_pages))}")
+            end = time.perf_counter()
+            elapsed = end - start
+            print(f"   Total time: {elapsed:.2f} seconds ({elapsed / 60:.2f} minutes)")
+            print(f"{'='*60}\n")
+
+    if total_cars:
+        pq.write_table(to_parquet_table(all_cars), PARTIAL_PARQUET_FILE, compression="zstd")
+        os.replace(PARTIAL_OUTPUT_FILE, OUTPUT_FILE)
+        os.replace(PARTIAL_PARQUET_FILE, PARQUET_FILE)
+        write_progress(page - 1)
+        print(f"\n✅ Scraping complete! Data saved to {OUTPUT_FILE} and {PARQUET_FILE}")
+    else:
+        os.remove(PARTIAL_OUTPUT_FILE)
+        print(f"\n⚠️  No data collected, {OUTPUT_FILE} left unchanged")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())